@@ -0,0 +1,91 @@
+"""Check the dashboard's cold start against COLD_START_BUDGET_MS.
+
+Imports spotify-dashboard.py in fresh interpreters (without running the
+app) and fails when the median wall time, interpreter start included,
+exceeds the budget. The slowest imports from ``python -X importtime`` are
+printed so a regression can be traced to a module.
+
+    python scripts/check_startup_budget.py [--runs 5] [--budget-ms 1500]
+"""
+import argparse
+import ast
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+DASHBOARD = Path(__file__).resolve().parent.parent / "spotify-dashboard.py"
+
+LOAD_DASHBOARD = (
+    "import importlib.util; "
+    f"spec = importlib.util.spec_from_file_location('spotify_dashboard', {str(DASHBOARD)!r}); "
+    "spec.loader.exec_module(importlib.util.module_from_spec(spec))"
+)
+
+
+def read_budget_ms():
+    """COLD_START_BUDGET_MS from the dashboard source, without importing it"""
+    tree = ast.parse(DASHBOARD.read_text(encoding="utf-8"))
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(
+                getattr(target, "id", None) == "COLD_START_BUDGET_MS" for target in node.targets):
+            return ast.literal_eval(node.value)
+    raise SystemExit("COLD_START_BUDGET_MS not found in spotify-dashboard.py")
+
+
+def measure_once():
+    """Wall time in ms of one cold import, plus the -X importtime report"""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", LOAD_DASHBOARD],
+                            capture_output=True, text=True)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        raise SystemExit("Importing spotify-dashboard.py failed")
+    return elapsed_ms, result.stderr
+
+
+def slowest_top_level_imports(report, count=10):
+    """(cumulative ms, module) for the top-level imports in an importtime report"""
+    imports = []
+    for line in report.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented below their parent
+        if not name.startswith("  "):
+            imports.append((int(cumulative) / 1000, name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="override COLD_START_BUDGET_MS")
+    args = parser.parse_args()
+
+    budget_ms = args.budget_ms if args.budget_ms is not None else read_budget_ms()
+    timings = []
+    report = ""
+    for _ in range(args.runs):
+        elapsed_ms, report = measure_once()
+        timings.append(elapsed_ms)
+
+    print("Slowest imports (cumulative, last run):")
+    for cumulative_ms, name in slowest_top_level_imports(report):
+        print(f"  {cumulative_ms:8.1f} ms  {name}")
+
+    median_ms = statistics.median(timings)
+    print(f"Cold start: median {median_ms:.0f} ms over {args.runs} runs "
+          f"(min {min(timings):.0f} ms), budget {budget_ms:.0f} ms")
+    if median_ms > budget_ms:
+        print("FAIL: cold start exceeds the budget")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
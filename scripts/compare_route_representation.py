@@ -0,0 +1,128 @@
+"""Compare the Route object with the old dict-based route representation.
+
+Builds a synthetic GraphHopper response (5,000 steps and 100,000
+[lng, lat, ele] points by default) and reports memory, pickle size,
+pickle round trip and per-rerun step formatting time for both the dict
+layout the dashboard used before and the array-backed Route.
+
+    python scripts/compare_route_representation.py [--steps 5000] [--points 100000]
+"""
+import argparse
+import importlib.util
+import pickle
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+DASHBOARD = Path(__file__).resolve().parent.parent / "spotify-dashboard.py"
+
+
+def load_dashboard():
+    spec = importlib.util.spec_from_file_location("spotify_dashboard", DASHBOARD)
+    module = importlib.util.module_from_spec(spec)
+    # Registered so pickle can find Route by module name
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def synthetic_response(num_steps, num_points, seed=1):
+    rng = random.Random(seed)
+    instructions = [{
+        'distance': rng.uniform(10, 3000),
+        'text': f"Linksaf slaan op Straat {i}",
+        'sign': rng.choice([-3, -2, -1, 0, 1, 2, 3, 6]),
+        'time': rng.randint(1000, 90000)
+    } for i in range(num_steps)]
+    coordinates = [[4.8 + rng.random(), 52.0 + rng.random(), rng.random() * 10]
+                   for _ in range(num_points)]
+    return {'paths': [{
+        'distance': sum(i['distance'] for i in instructions),
+        'time': sum(i['time'] for i in instructions),
+        'ascend': 100, 'descend': 90,
+        'instructions': instructions,
+        'points': {'coordinates': coordinates}
+    }]}
+
+
+def legacy_route(data):
+    """The route dict parse_graphhopper_response produced before Route"""
+    path = data['paths'][0]
+    steps = [{
+        'distance': i.get('distance', 0),
+        'instruction': i.get('text', ''),
+        'direction': i.get('sign', 0),
+        'time': i.get('time', 0) // 1000
+    } for i in path.get('instructions', [])]
+    return {'routes': [{
+        'distance': path.get('distance', 0),
+        'duration': path.get('time', 0) // 1000,
+        'geometry': {'coordinates': [list(p) for p in path['points']['coordinates']]},
+        'steps': steps,
+        'elevation': path.get('ascend', 0),
+        'descent': path.get('descend', 0)
+    }]}
+
+
+def legacy_rerun(route, icons):
+    """Per-step formatting display_turn_by_turn did on every rerun"""
+    rendered = []
+    for step in route['routes'][0]['steps']:
+        distance = step['distance']
+        distance_text = f"{distance:.0f}m" if distance < 1000 else f"{distance/1000:.1f}km"
+        rendered.append((icons.get(step.get('direction', 0), '📍'),
+                         f"<b>{step['instruction']}</b><br><i>{distance_text} • {step['time']}s</i>"))
+    return rendered
+
+
+def route_rerun(route):
+    return list(zip(route.step_icons, route.step_labels))
+
+
+def measure(build, rerun, reruns):
+    tracemalloc.start()
+    route = build()
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    data = pickle.dumps(route)
+    pickle.loads(data)
+    round_trip = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(reruns):
+        rerun(route)
+    per_rerun = (time.perf_counter() - start) / reruns
+    return memory, len(data), round_trip, per_rerun
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--steps", type=int, default=5000)
+    parser.add_argument("--points", type=int, default=100000)
+    parser.add_argument("--reruns", type=int, default=10)
+    args = parser.parse_args()
+
+    dashboard = load_dashboard()
+    data = synthetic_response(args.steps, args.points)
+    navigation = dashboard.GraphHopperNavigation.__new__(dashboard.GraphHopperNavigation)
+
+    results = {
+        'dict': measure(lambda: legacy_route(data),
+                        lambda route: legacy_rerun(route, dashboard.DIRECTION_ICONS), args.reruns),
+        'Route': measure(lambda: navigation.parse_graphhopper_response(data),
+                         route_rerun, args.reruns),
+    }
+
+    print(f"{args.steps} steps, {args.points} points")
+    print(f"{'':8}{'memory':>12}{'pickle':>12}{'round trip':>14}{'per rerun':>12}")
+    for name, (memory, size, round_trip, per_rerun) in results.items():
+        print(f"{name:8}{memory / 1e6:>9.1f} MB{size / 1e6:>9.2f} MB"
+              f"{round_trip * 1000:>11.0f} ms{per_rerun * 1000:>9.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def dashboard():
+    """The dashboard script loaded as a module, without running the app"""
+    pytest.importorskip("streamlit")
+    path = Path(__file__).resolve().parent.parent / "spotify-dashboard.py"
+    spec = importlib.util.spec_from_file_location("spotify_dashboard", path)
+    module = importlib.util.module_from_spec(spec)
+    # Registered so pickle can find the classes by module name
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
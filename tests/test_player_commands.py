@@ -0,0 +1,70 @@
+import time
+
+
+class RecordingClient:
+    def __init__(self):
+        self.calls = []
+
+    def volume(self, value):
+        self.calls.append(('volume', value))
+
+    def start_playback(self, uris=None):
+        self.calls.append(('play', uris))
+
+    def pause_playback(self):
+        self.calls.append(('pause', None))
+
+    def next_track(self):
+        self.calls.append(('next', None))
+
+    def previous_track(self):
+        self.calls.append(('previous', None))
+
+
+def drain(queue, timeout=5):
+    deadline = time.time() + timeout
+    while queue.busy:
+        assert time.time() < deadline, "command queue did not drain"
+        time.sleep(0.01)
+
+
+def submit_all(queue, commands):
+    # Holding the (reentrant) condition keeps the worker from sending
+    # anything until every command is queued
+    with queue._cond:
+        for command in commands:
+            queue.submit(*command)
+
+
+def test_coalesced_playback_is_sent_after_earlier_skips(dashboard):
+    client = RecordingClient()
+    queue = dashboard.PlayerCommandQueue()
+    queue.bind(client)
+
+    submit_all(queue, [('playback', False), ('next',), ('playback', True),
+                       ('previous',), ('playback', False)])
+    drain(queue)
+
+    assert client.calls == [('next', None), ('previous', None), ('pause', None)]
+
+
+def test_volume_burst_sends_last_value_once(dashboard):
+    client = RecordingClient()
+    queue = dashboard.PlayerCommandQueue()
+    queue.bind(client)
+
+    submit_all(queue, [('volume', v) for v in range(0, 101, 10)])
+    drain(queue)
+
+    assert client.calls == [('volume', 100)]
+
+
+def test_failures_are_collected(dashboard):
+    queue = dashboard.PlayerCommandQueue()
+
+    queue.submit('next')
+    drain(queue)
+
+    failures = queue.pop_failures()
+    assert [kind for kind, _ in failures] == ['next']
+    assert queue.pop_failures() == []
@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+
+def track(track_id):
+    return {'type': 'track', 'id': track_id, 'album': {'images': []}}
+
+
+class QueueClient:
+    def __init__(self, playing, queue):
+        self.set(playing, queue)
+
+    def set(self, playing, queue):
+        self.playing = playing
+        self.tracks = queue
+
+    def queue(self):
+        return {'currently_playing': track(self.playing),
+                'queue': [track(t) for t in self.tracks]}
+
+
+def up_next_ids(prefetcher):
+    return [entry['track']['id'] for entry in prefetcher.peek()]
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "prefetch did not update"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def prefetcher(dashboard, monkeypatch):
+    pytest.importorskip("requests")
+    monkeypatch.setattr(dashboard, "PREFETCH_TRACK_END_SLACK", 0.05)
+    return dashboard.UpNextPrefetcher()
+
+
+def test_queue_is_refetched_when_the_track_runs_out(prefetcher):
+    client = QueueClient('a', ['b', 'c'])
+    prefetcher.bind(client)
+    prefetcher.refresh('a', remaining_ms=100)
+    wait_for(lambda: up_next_ids(prefetcher) == ['b', 'c'])
+
+    # Spotify moves on by itself; no rerun calls refresh() again
+    client.set('b', ['c', 'd'])
+    wait_for(lambda: up_next_ids(prefetcher) == ['c', 'd'])
+
+    # The rerun for the new track finds the prefetch already current
+    prefetcher.refresh('b')
+    assert prefetcher._worker is None
+
+
+def test_paused_track_does_not_refetch(prefetcher):
+    client = QueueClient('a', ['b'])
+    prefetcher.bind(client)
+    prefetcher.refresh('a', remaining_ms=100)
+    wait_for(lambda: up_next_ids(prefetcher) == ['b'])
+
+    prefetcher.refresh('a', remaining_ms=None)
+    client.set('b', ['c'])
+    time.sleep(0.3)
+    assert up_next_ids(prefetcher) == ['b']
@@ -0,0 +1,62 @@
+import pickle
+
+
+def make_route(dashboard):
+    return dashboard.Route(
+        distance=4200.5,
+        duration=900,
+        elevation=15,
+        descent=12,
+        coordinates=[[4.897, 52.3779, 1.5], [4.898, 52.3785, 2.0], [4.899, 52.379, -0.5]],
+        step_distances=[200, 1500.25, 0],
+        step_texts=["Vertrek", "Keer om op de Dam", "Bestemming bereikt"],
+        step_signs=[0, -98, 4],
+        step_times=[30, 200, 0],
+        copyright='GraphHopper Demo',
+        waypoints=["Albert Heijn", "Postkantoor"]
+    )
+
+
+def assert_same_route(a, b):
+    for name in ('distance', 'duration', 'elevation', 'descent', 'copyright', 'waypoints',
+                 'step_texts', 'step_icons', 'step_labels'):
+        assert getattr(a, name) == getattr(b, name), name
+    assert a.coordinates == b.coordinates
+    assert list(a.step_distances) == list(b.step_distances)
+    assert list(a.step_times) == list(b.step_times)
+    assert list(a.step_signs) == list(b.step_signs)
+
+
+def test_drops_elevation_from_coordinates(dashboard):
+    route = make_route(dashboard)
+
+    assert list(route.coordinates) == [4.897, 52.3779, 4.898, 52.3785, 4.899, 52.379]
+
+
+def test_bytes_round_trip(dashboard):
+    route = make_route(dashboard)
+
+    restored = dashboard.Route.from_bytes(route.to_bytes())
+
+    assert_same_route(route, restored)
+    assert list(restored.step_signs) == [0, -98, 4]
+    # Unknown sign codes fall back to the generic pin
+    assert restored.step_icons[1] == '📍'
+
+
+def test_pickle_round_trip(dashboard):
+    route = make_route(dashboard)
+
+    restored = pickle.loads(pickle.dumps(route))
+
+    assert isinstance(restored, dashboard.Route)
+    assert_same_route(route, restored)
+
+
+def test_round_trip_without_steps(dashboard):
+    route = dashboard.Route(0, 0, 0, 0, [], [], [], [], [])
+
+    restored = dashboard.Route.from_bytes(route.to_bytes())
+
+    assert restored.num_steps == 0
+    assert len(restored.coordinates) == 0
@@ -0,0 +1,86 @@
+import itertools
+import math
+import random
+import time
+
+import pytest
+
+
+def path_cost(matrix, order):
+    return sum(matrix[a][b] for a, b in zip(order, order[1:]))
+
+
+def random_matrix(n, seed, symmetric=False):
+    rng = random.Random(seed)
+    points = [(rng.uniform(0, 10000), rng.uniform(0, 10000)) for _ in range(n)]
+    matrix = [[0.0] * n for _ in range(n)]
+    for i, a in enumerate(points):
+        for j, b in enumerate(points):
+            if i != j:
+                detour = 1.0 if symmetric else rng.uniform(1.0, 1.5)
+                matrix[i][j] = math.dist(a, b) * detour
+    return matrix
+
+
+def brute_force_cost(matrix):
+    n = len(matrix)
+    return min(path_cost(matrix, [0, *middle, n - 1])
+               for middle in itertools.permutations(range(1, n - 1)))
+
+
+def assert_valid_order(order, n):
+    assert order[0] == 0
+    assert order[-1] == n - 1
+    assert sorted(order) == list(range(n))
+
+
+@pytest.mark.parametrize("n", [1, 2, 3, 4, 6, 9])
+def test_keeps_endpoints_and_visits_every_stop(dashboard, n):
+    order = dashboard.optimize_stop_order(random_matrix(n, seed=n))
+    assert_valid_order(order, n)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_near_optimal_on_small_asymmetric_matrices(dashboard, seed):
+    matrix = random_matrix(7, seed)
+    order = dashboard.optimize_stop_order(matrix)
+
+    assert_valid_order(order, 7)
+    # Nearest neighbour + 2-opt is a heuristic; allow a small gap
+    assert path_cost(matrix, order) <= brute_force_cost(matrix) * 1.2
+
+
+def test_finds_optimum_on_a_line(dashboard):
+    # Stops shuffled along a straight road: the only sensible order is sorted
+    positions = [0, 7, 2, 9, 4, 1, 8, 3, 10]
+    matrix = [[abs(a - b) for b in positions] for a in positions]
+
+    order = dashboard.optimize_stop_order(matrix)
+
+    assert [positions[i] for i in order] == [0, 1, 2, 3, 4, 7, 8, 9, 10]
+
+
+def test_avoids_unreachable_legs(dashboard):
+    matrix = random_matrix(8, seed=3)
+    for i in range(8):
+        for j in range(8):
+            # Stop 2 can only be reached from stop 5
+            if j == 2 and i not in (2, 5):
+                matrix[i][j] = float('inf')
+
+    order = dashboard.optimize_stop_order(matrix)
+
+    assert_valid_order(order, 8)
+    assert order[order.index(2) - 1] == 5
+    assert math.isfinite(path_cost(matrix, order))
+
+
+def test_fifty_stops_well_under_a_second(dashboard):
+    matrix = random_matrix(52, seed=52)
+
+    start = time.perf_counter()
+    order = dashboard.optimize_stop_order(matrix, time_limit=5)
+    elapsed = time.perf_counter() - start
+
+    assert_valid_order(order, 52)
+    assert elapsed < 0.5